@@ -1,9 +1,49 @@
-from django.core.management.base import BaseCommand
+from django.core.management.base import BaseCommand, CommandError
 from django.apps import apps
-from django.db import models
+from django.core.exceptions import FieldError
+from django.db import DatabaseError, connections, models, router
 from django.db.models import Q
 from django_visual_editor.models import EditorImage
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import closing
+import argparse
+import functools
+import itertools
+import math
 import re
+import threading
+
+_ID_BATCH_SIZE = 500
+_IMAGE_ID_MARKER = 'data-image-id="'
+_IMAGE_ID_RE = re.compile(r'data-image-id="(\d+)"')
+
+
+@functools.lru_cache(maxsize=None)
+def _text_fields(model):
+    """Return names of TextField or CharField fields that might contain HTML.
+
+    Short CharFields (slugs, usernames, emails) cannot hold editor markup.
+    """
+    return tuple(
+        field.name
+        for field in model._meta.get_fields()
+        if isinstance(field, models.TextField)
+        or (
+            isinstance(field, models.CharField)
+            and (field.max_length is None or field.max_length >= 256)
+        )
+    )
+
+
+def _positive_int(value):
+    """Parse a command-line integer that must be at least 1"""
+    try:
+        number = int(value)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"must be an integer, got {value!r}")
+    if number < 1:
+        raise argparse.ArgumentTypeError(f"must be at least 1, got {number}")
+    return number
 
 
 class Command(BaseCommand):
@@ -15,60 +55,165 @@ class Command(BaseCommand):
             action="store_true",
             help="Show what would be deleted without actually deleting",
         )
+        parser.add_argument(
+            "--workers",
+            type=_positive_int,
+            default=1,
+            help="Number of threads used to scan models concurrently",
+        )
+        parser.add_argument(
+            "--ignore-errors",
+            action="store_true",
+            help="Delete unused images even if some models could not be scanned",
+        )
+
+    def _scan_models(self, candidate_models, workers):
+        """Scan models, yielding results in order, optionally in threads"""
+        if workers <= 1:
+            yield from map(self._scan_model, candidate_models)
+            return
+
+        # Give each worker one contiguous slice so it opens a single
+        # connection for all of its models
+        slice_size = math.ceil(len(candidate_models) / workers) or 1
+        model_slices = [
+            candidate_models[i : i + slice_size]
+            for i in range(0, len(candidate_models), slice_size)
+        ]
+        stop = threading.Event()
+        executor = ThreadPoolExecutor(max_workers=workers)
+        try:
+            for results in executor.map(
+                self._scan_models_in_thread, model_slices, itertools.repeat(stop)
+            ):
+                yield from results
+        finally:
+            # Stop the remaining scans if the caller stops early
+            stop.set()
+            executor.shutdown(cancel_futures=True)
+
+    def _scan_models_in_thread(self, model_slice, stop):
+        """Scan a slice of models in a worker thread, then close its connections"""
+        try:
+            results = []
+            for model in model_slice:
+                if stop.is_set():
+                    break
+                results.append(self._scan_model(model))
+            return results
+        finally:
+            connections.close_all()
+
+    def _scan_model(self, model):
+        """Collect image IDs referenced from the text fields of a model.
+
+        Returns ``(checked, failed, used_image_ids, messages)``. Messages are
+        returned rather than written so that scans can run in worker threads.
+        """
+        used_image_ids = set()
+        messages = []
+        failed = False
+
+        try:
+            if not model._default_manager.exists():
+                return False, failed, used_image_ids, messages
+        except (DatabaseError, FieldError) as e:
+            messages.append(self.style.WARNING(f"Error checking {model.__name__}: {e}"))
+            return False, True, used_image_ids, messages
+
+        if self.verbosity >= 2:
+            messages.append(f"Checking {model.__name__}...")
+
+        for field_name in _text_fields(model):
+            try:
+                # Let the database skip rows without the marker, and
+                # stream only the field values, not whole model instances
+                contents = (
+                    model._default_manager.filter(
+                        **{f"{field_name}__contains": _IMAGE_ID_MARKER}
+                    )
+                    .values_list(field_name, flat=True)
+                    .iterator(chunk_size=2000)
+                )
+                for content in contents:
+                    if not content:
+                        continue
+
+                    # Find all image IDs in the content
+                    # Text field subclasses may return non-str values
+                    image_ids = _IMAGE_ID_RE.findall(str(content))
+                    used_image_ids.update(map(int, image_ids))
+
+            except (DatabaseError, FieldError) as e:
+                failed = True
+                messages.append(
+                    self.style.WARNING(
+                        f"Error checking {model.__name__}.{field_name}: {e}"
+                    )
+                )
+
+        return True, failed, used_image_ids, messages
+
+    def _table_exists(self, model):
+        """Check whether the model's table exists in its read database"""
+        alias = router.db_for_read(model)
+        if alias not in self._table_names:
+            self._table_names[alias] = set(
+                connections[alias].introspection.table_names()
+            )
+        return model._meta.db_table in self._table_names[alias]
 
     def handle(self, *args, **options):
         dry_run = options["dry_run"]
+        self.verbosity = options["verbosity"]
+        self._table_names = {}
 
         self.stdout.write("Searching for models with text/HTML fields...")
 
         # Find all uploaded images
-        all_images = EditorImage.objects.all()
-        total_images = all_images.count()
+        all_image_ids = set(EditorImage.objects.values_list("id", flat=True))
+        total_images = len(all_image_ids)
         self.stdout.write(f"Found {total_images} uploaded images")
 
+        if total_images == 0:
+            self.stdout.write(self.style.SUCCESS("No uploaded images found!"))
+            return
+
         # Find all models that might contain editor content
         used_image_ids = set()
         models_checked = 0
+        scan_failed = False
 
-        for model in apps.get_models():
-            # Look for TextField or CharField that might contain HTML
-            text_fields = [
-                field
-                for field in model._meta.get_fields()
-                if isinstance(field, (models.TextField, models.CharField))
-            ]
-
-            if not text_fields:
-                continue
-
-            models_checked += 1
-            self.stdout.write(f"Checking {model.__name__}...")
+        # Proxy models share their concrete model's table, EditorImage itself
+        # never holds editor content, and an unmanaged model whose table does
+        # not exist cannot reference any image
+        candidate_models = [
+            model
+            for model in apps.get_models()
+            if not model._meta.proxy
+            and model is not EditorImage
+            and _text_fields(model)
+            and (model._meta.managed or self._table_exists(model))
+        ]
+        with closing(self._scan_models(candidate_models, options["workers"])) as scans:
+            for checked, failed, model_image_ids, messages in scans:
+                for message in messages:
+                    self.stdout.write(message)
+                if checked:
+                    models_checked += 1
+                scan_failed = scan_failed or failed
+                used_image_ids |= model_image_ids
 
-            for field in text_fields:
-                try:
-                    # Get all instances
-                    for instance in model.objects.all():
-                        content = getattr(instance, field.name, "")
-                        if not content:
-                            continue
-
-                        # Find all image IDs in the content
-                        image_ids = re.findall(r'data-image-id="(\d+)"', str(content))
-                        used_image_ids.update(int(img_id) for img_id in image_ids)
-
-                except Exception as e:
-                    self.stdout.write(
-                        self.style.WARNING(
-                            f"Error checking {model.__name__}.{field.name}: {e}"
-                        )
-                    )
+                # Stop scanning once every uploaded image is known to be used
+                if all_image_ids <= used_image_ids:
+                    break
 
         self.stdout.write(f"Checked {models_checked} models")
         self.stdout.write(f"Found {len(used_image_ids)} images in use")
 
         # Find unused images
-        unused_images = all_images.exclude(id__in=used_image_ids)
-        unused_count = unused_images.count()
+        unused_ids = sorted(all_image_ids - used_image_ids)
+        unused_count = len(unused_ids)
 
         if unused_count == 0:
             self.stdout.write(self.style.SUCCESS("No unused images found!"))
@@ -76,21 +221,91 @@ class Command(BaseCommand):
 
         self.stdout.write(f"Found {unused_count} unused images")
 
+        # Images referenced from content that could not be read would be
+        # reported as unused, so only list them unless told otherwise
+        refuse_delete = scan_failed and not dry_run and not options["ignore_errors"]
+        if refuse_delete:
+            self.stdout.write(
+                self.style.ERROR(
+                    "Some models could not be scanned; images they reference "
+                    "may be listed as unused."
+                )
+            )
+            dry_run = True
+
+        # Query unused images in fixed-size id batches to stay under
+        # database parameter limits
+        id_batches = [
+            unused_ids[i : i + _ID_BATCH_SIZE]
+            for i in range(0, unused_count, _ID_BATCH_SIZE)
+        ]
+
         if dry_run:
             self.stdout.write(self.style.WARNING("DRY RUN - No images will be deleted"))
-            for image in unused_images:
-                self.stdout.write(
-                    f"  Would delete: {image.image.name} (ID: {image.id})"
+            for id_batch in id_batches:
+                unused_files = EditorImage.objects.filter(id__in=id_batch).values_list(
+                    "id", "image"
+                )
+                lines = [
+                    f"  Would delete: {path} (ID: {image_id})"
+                    for image_id, path in unused_files
+                ]
+                # Write one batch of lines at a time
+                if lines:
+                    self.stdout.write("\n".join(lines))
+
+            if refuse_delete:
+                raise CommandError(
+                    "No images were deleted because some models could not be "
+                    "scanned. Fix the errors above or re-run with --ignore-errors."
                 )
         else:
-            # Delete unused images
-            for image in unused_images:
-                self.stdout.write(f"Deleting: {image.image.name} (ID: {image.id})")
-                # Delete file from storage
-                image.image.delete(save=False)
-                # Delete database record
-                image.delete()
+            storage = EditorImage._meta.get_field("image").storage
+            deleted_count = 0
+            failed_count = 0
+
+            for id_batch in id_batches:
+                unused_files = EditorImage.objects.filter(id__in=id_batch).values_list(
+                    "id", "image"
+                )
+
+                # Delete files first; a record is only removed once its file
+                # is gone, so failed files are retried on the next run
+                deleted_ids = []
+                lines = []
+                try:
+                    for image_id, path in unused_files:
+                        try:
+                            if path:
+                                storage.delete(path)
+                        except Exception as e:
+                            # Storage backends raise their own exception types
+                            failed_count += 1
+                            lines.append(
+                                self.style.WARNING(
+                                    f"Error deleting: {path} (ID: {image_id}): {e}"
+                                )
+                            )
+                            continue
+                        deleted_ids.append(image_id)
+                        lines.append(f"Deleted: {path} (ID: {image_id})")
+                finally:
+                    # Report every file handled so far, even if interrupted
+                    if lines:
+                        self.stdout.write("\n".join(lines))
+
+                # Delete the batch's records in one query
+                EditorImage.objects.filter(id__in=deleted_ids).delete()
+                deleted_count += len(deleted_ids)
 
             self.stdout.write(
-                self.style.SUCCESS(f"Successfully deleted {unused_count} unused images")
+                self.style.SUCCESS(
+                    f"Successfully deleted {deleted_count} unused images"
+                )
             )
+
+            if failed_count:
+                raise CommandError(
+                    f"Could not delete {failed_count} image files; their records "
+                    "were kept and will be retried on the next run."
+                )
@@ -0,0 +1 @@
+# Test-only app, installed by test_settings
@@ -0,0 +1,25 @@
+from django.db import models
+
+
+class TestModel(models.Model):
+    """Test model with text fields that may hold editor content"""
+
+    # Not a test case, despite the name
+    __test__ = False
+
+    title = models.CharField(max_length=200, blank=True)
+    content = models.TextField(blank=True)
+
+    class Meta:
+        app_label = "djve_tests"
+
+
+class UnmanagedModel(models.Model):
+    """Unmanaged test model whose table is never created"""
+
+    content = models.TextField(blank=True)
+
+    class Meta:
+        app_label = "djve_tests"
+        managed = False
+        db_table = "djve_tests_missing_table"
@@ -1,22 +1,36 @@
-from django.test import TestCase
+from django.test import TestCase, TransactionTestCase, override_settings
 from django.core.management import call_command
 from django.core.files.uploadedfile import SimpleUploadedFile
-from django.db import models
+from django.core.management.base import CommandError
+from django.apps import apps
+from django.db import connections
+from django_visual_editor.management.commands.cleanup_editor_images import Command
 from django_visual_editor.models import EditorImage
+from djve_tests.models import TestModel
 from io import StringIO
+from unittest import mock
+import shutil
+import tempfile
 
 
-class TestModel(models.Model):
-    """Test model with a text field"""
+class TempMediaRootMixin:
+    """Store uploaded files in a temporary MEDIA_ROOT removed after each test"""
 
-    content = models.TextField()
+    def setUp(self):
+        super().setUp()
+        self.media_root = tempfile.mkdtemp()
+        self.media_override = override_settings(MEDIA_ROOT=self.media_root)
+        self.media_override.enable()
 
-    class Meta:
-        app_label = "django_visual_editor"
+    def tearDown(self):
+        self.media_override.disable()
+        shutil.rmtree(self.media_root, ignore_errors=True)
+        super().tearDown()
 
 
-class CleanupEditorImagesCommandTest(TestCase):
+class CleanupEditorImagesCommandTest(TempMediaRootMixin, TestCase):
     def setUp(self):
+        super().setUp()
         # Create test images
         self.used_image = EditorImage.objects.create(
             image=SimpleUploadedFile("used.jpg", b"content", content_type="image/jpeg")
@@ -61,3 +75,233 @@ class CleanupEditorImagesCommandTest(TestCase):
         output = out.getvalue()
         # With only one unused image or none
         self.assertIn("unused images", output.lower())
+
+    def test_cleanup_without_images(self):
+        """Test that cleanup stops early when there are no images"""
+        EditorImage.objects.all().delete()
+        out = StringIO()
+
+        call_command("cleanup_editor_images", stdout=out)
+
+        output = out.getvalue()
+        self.assertIn("No uploaded images found!", output)
+        self.assertNotIn("Checked", output)
+
+    def test_cleanup_stops_when_all_images_used(self):
+        """Test that scanning stops once every image is referenced"""
+        TestModel.objects.create(
+            content=(
+                f'<img data-image-id="{self.used_image.id}">'
+                f'<img data-image-id="{self.unused_image.id}">'
+            )
+        )
+        out = StringIO()
+
+        # The same model twice stands in for a later model to scan
+        with mock.patch.object(apps, "get_models", return_value=[TestModel] * 2):
+            call_command("cleanup_editor_images", verbosity=2, stdout=out)
+
+        output = out.getvalue()
+        self.assertEqual(output.count("Checking TestModel..."), 1)
+        self.assertIn("Checked 1 models", output)
+        self.assertIn("No unused images found!", output)
+
+    def test_cleanup_deletes_unused_images(self):
+        """Test that cleanup removes unused records and their files"""
+        storage = self.unused_image.image.storage
+        paths = [self.used_image.image.name, self.unused_image.image.name]
+        out = StringIO()
+
+        call_command("cleanup_editor_images", stdout=out)
+
+        output = out.getvalue()
+        self.assertIn("Successfully deleted 2 unused images", output)
+        self.assertEqual(EditorImage.objects.count(), 0)
+        for path in paths:
+            self.assertFalse(storage.exists(path))
+
+    def test_cleanup_keeps_records_when_file_delete_fails(self):
+        """Test that a record is kept when its file cannot be deleted"""
+        storage = self.unused_image.image.storage
+        failing_path = self.unused_image.image.name
+        delete = storage.delete
+
+        def flaky_delete(path):
+            if path == failing_path:
+                raise OSError("storage unavailable")
+            delete(path)
+
+        out = StringIO()
+        with mock.patch.object(storage, "delete", side_effect=flaky_delete):
+            with self.assertRaises(CommandError):
+                call_command("cleanup_editor_images", stdout=out)
+
+        output = out.getvalue()
+        self.assertIn(f"Error deleting: {failing_path}", output)
+        self.assertIn(f"Deleted: {self.used_image.image.name}", output)
+        self.assertIn("Successfully deleted 1 unused images", output)
+        self.assertEqual(
+            list(EditorImage.objects.values_list("id", flat=True)),
+            [self.unused_image.id],
+        )
+        self.assertTrue(storage.exists(failing_path))
+
+    def test_cleanup_reports_files_when_interrupted(self):
+        """Test that files handled before an interruption are still reported"""
+        storage = self.unused_image.image.storage
+        delete = storage.delete
+        calls = []
+
+        def interrupted_delete(path):
+            calls.append(path)
+            if len(calls) > 1:
+                raise KeyboardInterrupt
+            delete(path)
+
+        out = StringIO()
+        with mock.patch.object(storage, "delete", side_effect=interrupted_delete):
+            with self.assertRaises(KeyboardInterrupt):
+                call_command("cleanup_editor_images", stdout=out)
+
+        self.assertIn(f"Deleted: {calls[0]}", out.getvalue())
+        # Records are only deleted after their batch of files
+        self.assertEqual(EditorImage.objects.count(), 2)
+
+    @mock.patch(
+        "django_visual_editor.management.commands.cleanup_editor_images."
+        "_ID_BATCH_SIZE",
+        1,
+    )
+    def test_cleanup_deletes_in_batches(self):
+        """Test that unused images spanning several id batches are deleted"""
+        out = StringIO()
+
+        call_command("cleanup_editor_images", stdout=out)
+
+        self.assertIn("Successfully deleted 2 unused images", out.getvalue())
+        self.assertEqual(EditorImage.objects.count(), 0)
+
+    def test_cleanup_keeps_referenced_images(self):
+        """Test that images referenced from a TextField are kept"""
+        TestModel.objects.create(
+            content=f'<img src="x.jpg" data-image-id="{self.used_image.id}">'
+        )
+        out = StringIO()
+
+        call_command("cleanup_editor_images", stdout=out)
+
+        output = out.getvalue()
+        self.assertIn("Found 1 unused images", output)
+        self.assertNotIn("Error checking", output)
+        self.assertEqual(
+            list(EditorImage.objects.values_list("id", flat=True)),
+            [self.used_image.id],
+        )
+
+    def test_cleanup_ignores_short_char_fields(self):
+        """Test that short CharFields are not scanned for image references"""
+        TestModel.objects.create(title=f'data-image-id="{self.used_image.id}"')
+        out = StringIO()
+
+        call_command("cleanup_editor_images", "--dry-run", stdout=out)
+
+        self.assertIn("Found 2 unused images", out.getvalue())
+
+    def test_cleanup_verbose_lists_checked_models(self):
+        """Test that per-model progress is only shown at verbosity 2"""
+        TestModel.objects.create(content="plain text")
+        out = StringIO()
+        verbose_out = StringIO()
+
+        call_command("cleanup_editor_images", "--dry-run", stdout=out)
+        call_command(
+            "cleanup_editor_images", "--dry-run", verbosity=2, stdout=verbose_out
+        )
+
+        self.assertNotIn("Checking TestModel...", out.getvalue())
+        self.assertIn("Checking TestModel...", verbose_out.getvalue())
+
+    def test_cleanup_skips_unmanaged_model_without_table(self):
+        """Test that an unmanaged model with no table does not block deletion"""
+        out = StringIO()
+
+        call_command("cleanup_editor_images", verbosity=2, stdout=out)
+
+        output = out.getvalue()
+        self.assertNotIn("UnmanagedModel", output)
+        self.assertNotIn("Error checking", output)
+        self.assertIn("Successfully deleted 2 unused images", output)
+
+    @mock.patch(
+        "django_visual_editor.management.commands.cleanup_editor_images."
+        "_text_fields",
+        return_value=("missing_field",),
+    )
+    def test_cleanup_refuses_delete_after_scan_errors(self, text_fields):
+        """Test that images are kept when some content could not be scanned"""
+        out = StringIO()
+
+        with self.assertRaises(CommandError):
+            call_command("cleanup_editor_images", stdout=out)
+
+        output = out.getvalue()
+        self.assertIn("Error checking", output)
+        self.assertIn("Would delete", output)
+        self.assertEqual(EditorImage.objects.count(), 2)
+
+    @mock.patch(
+        "django_visual_editor.management.commands.cleanup_editor_images."
+        "_text_fields",
+        return_value=("missing_field",),
+    )
+    def test_cleanup_ignore_errors_deletes(self, text_fields):
+        """Test that --ignore-errors deletes despite scan errors"""
+        out = StringIO()
+
+        call_command("cleanup_editor_images", "--ignore-errors", stdout=out)
+
+        self.assertIn("Successfully deleted 2 unused images", out.getvalue())
+        self.assertEqual(EditorImage.objects.count(), 0)
+
+
+class CleanupEditorImagesWorkersTest(TempMediaRootMixin, TransactionTestCase):
+    def test_cleanup_with_workers(self):
+        """Test that scanning models in worker threads finds used images"""
+        used_image = EditorImage.objects.create(
+            image=SimpleUploadedFile("used.jpg", b"content", content_type="image/jpeg")
+        )
+        EditorImage.objects.create(
+            image=SimpleUploadedFile(
+                "unused.jpg", b"content", content_type="image/jpeg"
+            )
+        )
+        TestModel.objects.create(content=f'<img data-image-id="{used_image.id}">')
+        out = StringIO()
+
+        call_command("cleanup_editor_images", "--workers", "2", stdout=out)
+
+        self.assertIn("Found 1 unused images", out.getvalue())
+        self.assertEqual(
+            list(EditorImage.objects.values_list("id", flat=True)), [used_image.id]
+        )
+
+    def test_workers_close_connections_once_per_thread(self):
+        """Test that each worker thread closes its connections once"""
+        command = Command()
+        command.verbosity = 1
+        candidate_models = [TestModel] * 4
+
+        with mock.patch.object(
+            connections, "close_all", wraps=connections.close_all
+        ) as close_all:
+            results = list(command._scan_models(candidate_models, workers=2))
+
+        self.assertEqual(len(results), 4)
+        self.assertEqual(close_all.call_count, 2)
+
+    def test_cleanup_rejects_invalid_workers(self):
+        """Test that --workers must be at least 1"""
+        with self.assertRaises(CommandError):
+            call_command("cleanup_editor_images", "--workers", "0")
+        with self.assertRaisesMessage(CommandError, "must be an integer, got 'abc'"):
+            call_command("cleanup_editor_images", "--workers", "abc")
@@ -22,6 +22,7 @@ INSTALLED_APPS = [
     "django.contrib.messages",
     "django.contrib.staticfiles",
     "django_visual_editor",
+    "djve_tests",
 ]
 
 MIDDLEWARE = [
@@ -63,6 +64,11 @@ DATABASES = {
 # Password validation
 AUTH_PASSWORD_VALIDATORS = []
 
+# Fast password hashing for tests
+PASSWORD_HASHERS = [
+    "django.contrib.auth.hashers.MD5PasswordHasher",
+]
+
 # Internationalization
 LANGUAGE_CODE = "en-us"
 TIME_ZONE = "UTC"